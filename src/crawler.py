@@ -1,12 +1,30 @@
+import asyncio
+import codecs
+import concurrent.futures
+import functools
+import multiprocessing
 import os
+import random
+import re
 import time
-from typing import Set, Optional
+from typing import IO, Dict, Iterable, List, Set, Optional, Tuple, Union
 from urllib.robotparser import RobotFileParser
+import aiofiles
+from aiofiles.threadpool.text import AsyncTextIOWrapper
+import aiohttp
 import trafilatura
-from bs4 import BeautifulSoup
+import lxml.etree
 import requests
-from urllib.parse import urljoin, urlparse
-from markitdown import MarkItDown
+from urllib.parse import urljoin, urlparse, urlunparse
+
+# robots.txtのディスクキャッシュの有効期限（秒）
+ROBOTS_CACHE_TTL = 24 * 60 * 60
+
+# ページ本文を受信する際のチャンクサイズ（バイト）
+FETCH_CHUNK_SIZE = 8192
+
+# 出力ファイルのバッファをディスクへ書き出す間隔（ページ数）
+FLUSH_EVERY_PAGES = 20
 
 class DocCrawler:
     """ドキュメントサイトをクロールしてテキストコンテンツを抽出するクローラー
@@ -20,8 +38,9 @@ class DocCrawler:
         user_agent (str): クロール時に使用するUser-Agent文字列
         visited_urls (Set[str]): クロール済みURLを管理するセット
         library_name (str): クロール対象のライブラリ名（URLから抽出）
-        rp (RobotFileParser): robots.txtを解析するパーサー
-        crawl_delay (float): クロール間隔（秒）
+        crawl_delay (float): ホストへのリクエスト間隔（秒）。ワーカー全体で共有する
+        concurrency (int): 同時にクロールするワーカー数
+        aiohttp_session (aiohttp.ClientSession | None): クロール中に使用する非同期HTTPセッション
     """
 
     def __init__(
@@ -29,7 +48,9 @@ class DocCrawler:
         base_url: str, 
         output_dir: str = "output", 
         user_agent: str = "DocCrawler/1.0",
-        output_file_name: str = "crawled_content.md"
+        output_file_name: str = "crawled_content.md",
+        concurrency: int = 5,
+        resume: bool = False
     ) -> None:
         """クローラーの初期化
 
@@ -38,11 +59,23 @@ class DocCrawler:
             output_dir: 抽出したテキストの保存先ディレクトリ（デフォルト: output）
             user_agent: クロール時に使用するUser-Agent文字列（デフォルト: "DocCrawler/1.0"）
             output_file_name: すべてのコンテンツを書き出す単一ファイル名
+            concurrency: 同時にクロールするワーカー数（デフォルト: 5）
+            resume: Trueの場合、output_dir内のチェックポイントから前回のクロールを再開する
+
+        Raises:
+            ValueError: concurrencyが1未満の場合
         """
+        # ワーカーが1つもないとキューが空にならず、crawl()が終わらない
+        if concurrency < 1:
+            raise ValueError(f"concurrencyには1以上を指定してください: {concurrency}")
+
         self.base_url = base_url
         self.user_agent = user_agent
         self.visited_urls: Set[str] = set()
 
+        # 全リクエスト共通のヘッダー（一度だけ作って使い回す）
+        self._headers = {"User-Agent": user_agent}
+
         # 出力ディレクトリを作成
         self.output_dir = output_dir
         os.makedirs(self.output_dir, exist_ok=True)
@@ -50,31 +83,177 @@ class DocCrawler:
         # 「すべてのページを集約するためのファイル」を一意に決める
         self.output_file_path = os.path.join(self.output_dir, output_file_name)
 
-        # ライブラリ名の取得（URLから）
-        self.library_name = urlparse(base_url).path.strip("/").split("/")[0]
+        # 追記用のファイルハンドル（crawl()の間だけaiofilesで開いたままにしておく）
+        self._aio_out: Optional[AsyncTextIOWrapper] = None
+        self._write_lock = asyncio.Lock()
+        self._pages_since_flush = 0
+        # 出力がまだフラッシュされていないページのURL（フラッシュ後に.visited.txtへ記録する）
+        self._unflushed_visited: List[str] = []
+
+        # crawled_atの文字列は秒単位で十分なので、同じ秒の間は整形済みの値を使い回す
+        self._last_ts_epoch = 0
+        self._last_ts_str = ""
+
+        # チェックポイント（処理済みURLとキューに積んだURL）の読み込み
+        self._visited_path = os.path.join(self.output_dir, ".visited.txt")
+        self._frontier_path = os.path.join(self.output_dir, ".frontier.txt")
+        self._pending_urls: List[str] = []
+        self._enqueued: Set[str] = set()
+        if resume:
+            self._load_checkpoint()
+        self._resumed_pages = len(self.visited_urls)
+        # チェックポイントのファイルハンドル（crawl()の間だけ開く。再開時は追記する）
+        self._resume = resume
+        self._visited_fp: Optional[IO[str]] = None
+        self._frontier_fp: Optional[IO[str]] = None
 
-        # robots.txtの解析
-        self.rp = RobotFileParser()
+        # ライブラリ名の取得（URLから）
         parsed_url = urlparse(base_url)
-        robots_url = f"{parsed_url.scheme}://{parsed_url.netloc}/robots.txt"
-        self.rp.set_url(robots_url)
+        self.library_name = parsed_url.path.strip("/").split("/")[0]
+
+        # is_valid_urlで毎回base_urlをパースしないよう、判定用の値を保持しておく
+        # （_canonicalize()に合わせてホスト名は小文字にそろえる）
+        self._url_prefix = f"{parsed_url.scheme}://{parsed_url.netloc.lower()}/"
+        # Sphinxが生成するソース・静的ファイル等のディレクトリを1回の検索で除外する
+        self._exclude_re = re.compile(r"/_(?:sources|static|images|downloads|modules)/")
+
+        # robots.txtの解析（ホストごとのパーサーを保持する）
+        # robots.txtの取得はブロッキング処理なので、ここ（クロール開始前）でのみ行う。
+        # 現在サポートしているのはbase_urlのホストだけで、読み込んでいないホストは拒否する
+        self._robots_scheme = parsed_url.scheme
+        self._robots: Dict[str, RobotFileParser] = {}
+        base_rp = self._robots_for(parsed_url.netloc)
+
+        # can_fetchの判定結果をURLごとにキャッシュ（ルールの照合はリンクごとに何度も行われるため）
+        self._can_fetch_cached = functools.lru_cache(maxsize=4096)(self._can_fetch)
+
+        # 並行クロールの設定（aiohttpのセッションはcrawl()の中で生成する）
+        self.concurrency = concurrency
+
+        # ホストへのリクエスト間隔。robots.txtのCrawl-delayがあればそのまま守り、
+        # ない場合はデフォルトの1秒をワーカー数で分け合う
+        self.crawl_delay = self._get_crawl_delay(base_rp) or 1.0 / concurrency
+        # 次にリクエストしてよい時刻（イベントループの時刻）。全ワーカーで共有する
+        self._next_request_at = 0.0
+        self._rate_lock = asyncio.Lock()
+
+        self.aiohttp_session: Optional[aiohttp.ClientSession] = None
+
+        # 本文抽出（CPU処理）を並列に実行するプロセスプール（crawl()の間だけ生成する）
+        self._pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+    def _load_checkpoint(self) -> None:
+        """前回のクロールのチェックポイントを読み込む
+
+        処理済みのURLをvisited_urlsに復元し、キューに積まれたまま処理されなかった
+        URLを再開時のクロール対象として保持します。
+        """
+        try:
+            with open(self._visited_path, encoding="utf-8") as f:
+                self.visited_urls = set(f.read().splitlines())
+            with open(self._frontier_path, encoding="utf-8") as f:
+                frontier = f.read().splitlines()
+        except OSError:
+            print("チェックポイントが見つからないため、最初からクロールします")
+            return
+
+        self._pending_urls = [
+            u for u in dict.fromkeys(frontier) if u and u not in self.visited_urls
+        ]
+        print(
+            f"チェックポイントを読み込みました: 処理済み {len(self.visited_urls)} 件、"
+            f"未処理 {len(self._pending_urls)} 件"
+        )
+
+    def _can_fetch(self, url: str) -> bool:
+        """robots.txtのルール上、URLを取得してよいかを判定
+
+        読み込み済みのパーサーだけを参照し、クロール中にrobots.txtを取得することはありません
+        （イベントループをブロックしないため）。robots.txtを読み込んでいないホストはFalseになります。
+
+        Args:
+            url: 判定対象のURL
+
+        Returns:
+            bool: 取得してよい場合はTrue
+        """
+        rp = self._robots.get(urlparse(url).netloc.lower())
+        return rp is not None and rp.can_fetch(self.user_agent, url)
+
+    def _robots_for(self, netloc: str) -> RobotFileParser:
+        """ホストに対応するrobots.txtのパーサーを返す（初回のみ読み込む）
+
+        robots.txtの取得は同期的に行うため、クロール開始前（__init__）からのみ呼び出します。
+
+        Args:
+            netloc: 対象のホスト（例：docs.pola.rs）
+
+        Returns:
+            RobotFileParser: そのホストのrobots.txtを読み込んだパーサー
+        """
+        netloc = netloc.lower()
+        rp = self._robots.get(netloc)
+        if rp is None:
+            rp = RobotFileParser()
+            robots_url = f"{self._robots_scheme}://{netloc}/robots.txt"
+            rp.set_url(robots_url)
+            self._load_robots(rp, robots_url)
+            self._robots[netloc] = rp
+        return rp
+
+    def _load_robots(self, rp: RobotFileParser, robots_url: str) -> None:
+        """robots.txtを読み込んでパーサーに渡す
+
+        output_dir/.robots_cache/ に有効期限内のキャッシュがあればそれを使い、
+        なければ取得してキャッシュに書き出します。
+
+        Args:
+            rp: 読み込んだ内容を渡すパーサー
+            robots_url: robots.txtのURL
+        """
+        cache_dir = os.path.join(self.output_dir, ".robots_cache")
+        cache_name = urlparse(robots_url).netloc.replace(":", "_")
+        cache_path = os.path.join(cache_dir, f"{cache_name}.txt")
+
         try:
-            self.rp.read()
+            if time.time() - os.path.getmtime(cache_path) < ROBOTS_CACHE_TTL:
+                with open(cache_path, encoding="utf-8") as f:
+                    rp.parse(f.read().splitlines())
+                print(f"robots.txtをキャッシュから読み込みました: {cache_path}")
+                return
+        except OSError:
+            pass  # キャッシュがない、または読めない場合は取得し直す
+
+        try:
+            response = requests.get(robots_url, headers=self._headers, timeout=(5, 30))
+            # RobotFileParser.read()と同じく、401/403は全拒否、その他の4xxは全許可
+            if response.status_code in (401, 403):
+                robots_txt = "User-agent: *\nDisallow: /\n"
+            elif 400 <= response.status_code < 500:
+                robots_txt = ""
+            else:
+                response.raise_for_status()
+                robots_txt = response.text
+            rp.parse(robots_txt.splitlines())
+            # robots.txtがない（404など）ホストも多いため、4xxの結果も同じ内容としてキャッシュする
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cache_path, "w", encoding="utf-8") as f:
+                f.write(robots_txt)
             print(f"robots.txtを読み込みました: {robots_url}")
         except Exception as e:
             print(f"Warning: robots.txtの読み込みに失敗しました: {e}")
 
-        # Crawl-delay（デフォルト: 1秒）
-        self.crawl_delay = self._get_crawl_delay() or 1.0
-
-    def _get_crawl_delay(self) -> Optional[float]:
+    def _get_crawl_delay(self, rp: RobotFileParser) -> Optional[float]:
         """robots.txtからCrawl-delayを取得
 
+        Args:
+            rp: クロール対象ホストのrobots.txtを読み込んだパーサー
+
         Returns:
             float | None: 取得したCrawl-delay値（秒）。取得できない場合はNone
         """
         try:
-            return float(self.rp.crawl_delay("*") or self.rp.request_rate("*").seconds)
+            return float(rp.crawl_delay("*") or rp.request_rate("*").seconds)
         except (AttributeError, TypeError):
             return None
 
@@ -82,138 +261,357 @@ class DocCrawler:
         """URLが有効なクロール対象かを判定
 
         以下の条件をすべて満たすURLを有効と判定します：
-        1. base_urlと同じドメイン
+        1. base_urlと同じスキーム・ドメイン
         2. .htmlで終わるか、/で終わる（ディレクトリ）
-        3. /_sources/や/_static/を含まない
+        3. /_sources/、/_static/、/_images/、/_downloads/、/_modules/を含まない
         4. robots.txtのルールに違反しない
 
         Args:
-            url: 判定対象のURL
+            url: 判定対象のURL（_canonicalize 済みで、ホスト名が小文字であること）
 
         Returns:
             bool: URLが有効な場合はTrue、それ以外はFalse
         """
-        parsed_base = urlparse(self.base_url)
-        parsed_url = urlparse(url)
-
-        # 同じドメインかどうか
-        if parsed_url.netloc != parsed_base.netloc:
+        # リンクごとにurlparseしないよう、すべて文字列操作で判定する
+        # 同じドメインかどうか（スキームとホストを含む接頭辞で比較）
+        if not url.startswith(self._url_prefix):
             return False
 
-        # パスが .html で終わる、または / で終わること
-        if not (parsed_url.path.endswith(".html") or parsed_url.path.endswith("/")):
+        # フラグメントとクエリを除いたパスが .html で終わる、または / で終わること
+        path = url.partition("#")[0].partition("?")[0]
+        if not (path.endswith(".html") or path.endswith("/")):
             return False
 
-        # /_sources/, /_static/ を含まないこと
-        if "/_sources/" in parsed_url.path or "/_static/" in parsed_url.path:
+        # /_sources/, /_static/ などを含まないこと
+        if self._exclude_re.search(path):
             return False
 
         # robots.txtルールに違反していないか
-        return self.rp.can_fetch(self.user_agent, url)
+        return self._can_fetch_cached(url)
+
+    def _filter_links(self, hrefs: Iterable[str], url: str) -> Set[str]:
+        """href属性の値から有効なリンクだけを絶対URL（正規化済み）にして返す
+
+        Args:
+            hrefs: ページ内の<a>タグのhref属性の値
+            url: ページのURL（相対リンクの解決に使用）
+
+        Returns:
+            Set[str]: 有効なリンクのセット
+        """
+        links = set()
+        prefix_len = len(self._url_prefix)
+
+        for href in hrefs:
+            absolute_url = urljoin(url, href)
+            # 別サイトへのリンクは正規化（urlparse）する前に文字列の比較だけで除く
+            # （ホスト名の大文字・小文字は区別しない）
+            if absolute_url[:prefix_len].lower() != self._url_prefix:
+                continue
 
-    def extract_links(self, url: str) -> Set[str]:
-        """ページ内の有効なリンクを抽出
+            # アンカー違いなどで同じページを何度も取得しないよう、正規化してから判定する
+            canonical_url = self._canonicalize(absolute_url)
+            if self.is_valid_url(canonical_url):
+                print(f"有効なリンクを発見: {canonical_url}")
+                links.add(canonical_url)
+
+        print(f"\n合計 {len(links)} 個の有効なリンクを発見\n")
+        return links
+
+    async def _fetch(self, url: str) -> Tuple[Optional[Union[str, bytes]], List[str]]:
+        """ページを少しずつ受信しながら、<a>タグのhrefを取り出す
+
+        受信したチャンクをその都度lxmlのプルパーサーに渡すため、ダウンロード完了後に
+        リンク抽出のためだけにHTML全体をもう一度パースする必要がありません。
+        処理済みの<a>要素はすぐに破棄します。
+        Content-Typeヘッダーでcharsetが指定されている場合は、その文字コードで解釈します。
 
         Args:
-            url: リンクを抽出するページのURL
+            url: 取得するページのURL
 
         Returns:
-            Set[str]: 有効なリンクのセット。エラー時は空集合
+            Tuple[Optional[Union[str, bytes]], List[str]]: HTML本文（charsetが分かる場合は
+            デコード済みの文字列、分からない場合はバイト列。取得できない場合はNone）と、
+            見つかったhref属性の値のリスト
         """
-        headers = {"User-Agent": self.user_agent}
+        hrefs: List[str] = []
+        chunks: List[bytes] = []
+
+        # crawl()の中でのみ呼ばれるため、セッションは必ず生成済み
+        assert self.aiohttp_session is not None
+        async with self.aiohttp_session.get(url) as response:
+            if response.status != 200:
+                return None, hrefs
+
+            # ヘッダーのcharsetを優先する（ない場合はlxmlが<meta>などから判定する）
+            charset = response.charset
+            if charset:
+                try:
+                    codecs.lookup(charset)
+                except LookupError:
+                    charset = None
+            parser = lxml.etree.HTMLPullParser(events=("end",), tag="a", encoding=charset)
+
+            def collect_hrefs() -> None:
+                for _, element in parser.read_events():
+                    if not isinstance(element, lxml.etree._Element):
+                        continue
+                    href = element.get("href")
+                    if href:
+                        hrefs.append(href)
+                    element.clear()
+
+            async for chunk in response.content.iter_chunked(FETCH_CHUNK_SIZE):
+                chunks.append(chunk)
+                parser.feed(chunk)
+                collect_hrefs()
+
         try:
-            response = requests.get(url, headers=headers)
-            soup = BeautifulSoup(response.text, "html.parser")
-            links = set()
+            parser.close()
+        except lxml.etree.XMLSyntaxError:
+            pass  # 空のページなど、パースできる内容がない場合
+        collect_hrefs()
 
-            for a_tag in soup.find_all("a", href=True):
-                href = a_tag["href"]
-                absolute_url = urljoin(url, href)
+        html = b"".join(chunks)
+        # trafilaturaが文字コードを推測し直さないよう、分かっている場合はデコードして渡す
+        return (html.decode(charset, errors="replace") if charset else html), hrefs
 
-                if self.is_valid_url(absolute_url):
-                    print(f"有効なリンクを発見: {absolute_url}")
-                    links.add(absolute_url)
+    def _canonicalize(self, url: str) -> str:
+        """同じページを指すURLを1つの形にそろえる
 
-            print(f"\n合計 {len(links)} 個の有効なリンクを発見\n")
-            return links
-        except Exception as e:
-            print(f"Error extracting links from {url}: {e}")
-            return set()
+        フラグメントを除去し、ホスト名を小文字にし、末尾の index.html を取り除きます
+        （/foo/ と /foo/index.html は同じページとして扱う）。
+
+        Args:
+            url: 正規化するURL
+
+        Returns:
+            str: 正規化したURL
+        """
+        p = urlparse(url)
+        path = p.path or "/"
+        if path.endswith("/index.html"):
+            path = path[: -len("index.html")]
+        return urlunparse((p.scheme, p.netloc.lower(), path, "", p.query, ""))
 
-    def crawl(self, url: str, max_pages: Optional[int] = None) -> None:
-        """再帰的にページをクロールしてコンテンツを抽出
+    async def crawl(self, url: str, max_pages: Optional[int] = None) -> None:
+        """複数のワーカーで並行してページをクロールしてコンテンツを抽出
 
         Args:
             url: クロール開始URL
             max_pages: 最大クロールページ数（Noneの場合は制限なし）
         """
-        # すでに訪問したURL、または最大ページ数に達した場合は処理終了
-        if url in self.visited_urls:
-            return
-        if max_pages is not None and len(self.visited_urls) >= max_pages:
-            return
+        queue: asyncio.Queue[str] = asyncio.Queue()
+        # 再開時は前回キューに残っていたURLから続ける。開始URLは.frontier.txtに記録されず、
+        # 最初のフラッシュ前に中断すると.visited.txtにも残らないため、常にキューに積む
+        # （処理済みであればワーカーがスキップする）
+        start_urls = list(dict.fromkeys([self._canonicalize(url), *self._pending_urls]))
+        for pending_url in start_urls:
+            queue.put_nowait(pending_url)
+        # 一度キューに積んだURLを二重に積まないよう記録しておく
+        self._enqueued = set(start_urls)
+
+        connector = aiohttp.TCPConnector(limit_per_host=self.concurrency, keepalive_timeout=75)
+        timeout = aiohttp.ClientTimeout(total=None, connect=5, sock_read=30)
+        # チェックポイントは1行ずつ確実に書き出されるよう、行バッファリングで開く
+        # （再開しない場合は前回のチェックポイントを消して書き直す）
+        mode = "a" if self._resume else "w"
+        with open(
+            self._visited_path, mode, encoding="utf-8", buffering=1
+        ) as visited_fp, open(
+            self._frontier_path, mode, encoding="utf-8", buffering=1
+        ) as frontier_fp:
+            # 出力ファイルはページごとにopen/closeせず、書き込みはaiofilesでスレッドに任せて
+            # イベントループを止めないようにする
+            async with aiofiles.open(
+                self.output_file_path, "a", encoding="utf-8", buffering=1 << 20
+            ) as out, aiohttp.ClientSession(
+                connector=connector,
+                timeout=timeout,
+                headers=self._headers,
+            ) as session:
+                self._visited_fp = visited_fp
+                self._frontier_fp = frontier_fp
+                self._aio_out = out
+                self.aiohttp_session = session
+                # スレッドを持つプロセス（aiohttpやaiofiles）をforkするとデッドロックしうるため、
+                # ワーカープロセスはforkserverから起動する
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=os.cpu_count(),
+                    mp_context=multiprocessing.get_context("forkserver"),
+                )
+                workers = [
+                    asyncio.create_task(self._worker(queue, max_pages))
+                    for _ in range(self.concurrency)
+                ]
+                try:
+                    # キューが空になり、すべてのページの処理が終わるまで待つ
+                    await queue.join()
+                finally:
+                    for worker in workers:
+                        worker.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
+                    await self._flush_output()
+                    self._pool.shutdown(cancel_futures=True)
+                    self._pool = None
+                    self.aiohttp_session = None
+                    self._aio_out = None
+                    self._visited_fp = None
+                    self._frontier_fp = None
+
+    async def _worker(self, queue: "asyncio.Queue[str]", max_pages: Optional[int]) -> None:
+        """キューからURLを取り出してクロールし、見つかったリンクをキューに戻すワーカー"""
+        while True:
+            url = await queue.get()
+            try:
+                # すでに訪問したURL、または最大ページ数に達した場合はスキップ
+                if url in self.visited_urls:
+                    continue
+                if self._budget_exhausted(max_pages):
+                    continue
+
+                self.visited_urls.add(url)
+                # 訪問済み・キューに積み済みのURLはここで除き、新しいリンクだけを扱う
+                links = await self._crawl_page(url) - self.visited_urls - self._enqueued
+
+                # 子リンクを先に記録しておく（中断しても未処理のURLを失わない）
+                assert self._frontier_fp is not None  # crawl()の中でのみ呼ばれる
+                self._frontier_fp.writelines(f"{link}\n" for link in links)
+                # 処理済みとしての記録は、このページの出力がフラッシュされるまで保留する
+                # （出力が失われたページを再開時に処理済みとして扱わないため）
+                self._unflushed_visited.append(url)
+                if self._pages_since_flush >= FLUSH_EVERY_PAGES:
+                    await self._flush_output()
+
+                # 最大ページ数に達していれば、これ以上キューを増やさない
+                if not self._budget_exhausted(max_pages):
+                    self._enqueued |= links
+                    for link in links:
+                        queue.put_nowait(link)
+            finally:
+                queue.task_done()
+
+    async def _wait_for_turn(self) -> None:
+        """ホストへのリクエスト間隔がcrawl_delay以上になるまで待つ
+
+        次にリクエストしてよい時刻をロックの中で予約するため、ワーカー数によらず
+        ホストから見たリクエスト間隔はcrawl_delayの1〜2倍（ランダム）になります。
+        待機は前のリクエストの取得・処理と並行して進むため、取得時間が間隔に上乗せされません。
+        """
+        loop = asyncio.get_running_loop()
+        async with self._rate_lock:
+            now = loop.time()
+            start = max(now, self._next_request_at)
+            self._next_request_at = start + random.uniform(self.crawl_delay, self.crawl_delay * 2)
+        await asyncio.sleep(start - now)
+
+    def _budget_exhausted(self, max_pages: Optional[int]) -> bool:
+        """今回の実行で最大クロールページ数に達したかを判定（再開前の処理済みページは数えない）"""
+        return (
+            max_pages is not None
+            and len(self.visited_urls) - self._resumed_pages >= max_pages
+        )
+
+    async def _crawl_page(self, url: str) -> Set[str]:
+        """1ページを取得してコンテンツを保存し、ページ内の有効なリンクを返す
 
-        self.visited_urls.add(url)
+        HTMLの取得は1回だけ行い、受信中にリンクを取り出し、受信したHTMLから本文を抽出します。
+
+        Args:
+            url: クロールするページのURL
+
+        Returns:
+            Set[str]: ページ内の有効なリンクのセット。エラー時は空集合
+        """
         print(f"Crawling: {url}")
+        loop = asyncio.get_running_loop()
 
         try:
-            # Crawl-delayを考慮
-            time.sleep(self.crawl_delay)
+            # ワーカー全体でCrawl-delayを守れるよう、自分の番が来るまで待つ
+            await self._wait_for_turn()
 
-            # ページの内容を取得
-            downloaded = trafilatura.fetch_url(url)
+            # ページの内容を取得（受信しながらリンクも取り出す）
+            downloaded, hrefs = await self._fetch(url)
             if not downloaded:
                 print(f"Warning: Could not fetch content from {url}")
-                return
-
-            # テキスト抽出
-            content = trafilatura.extract(downloaded)
+                return set()
+
+            # Markdown形式で本文を抽出（CPU処理なのでGILの影響を受けないよう別プロセスで実行）
+            # url=は渡さない（trafilaturaは相対リンクをページではなくホストのルート基準で解決するため）
+            extract = functools.partial(
+                trafilatura.extract,
+                downloaded,
+                output_format="markdown",
+                include_links=True,
+            )
+            content_future = loop.run_in_executor(self._pool, extract)
+
+            # 本文抽出の間に、受信時に取り出したhrefから次にクロールするリンクを選別
+            links = self._filter_links(hrefs, url)
+
+            content = await content_future
             if not content:
                 print(f"Warning: Could not extract content from {url}")
-                return
+                return set()
 
             print(f"\n取得したコンテンツ(先頭500文字):\n{content[:500]}...\n")
 
             # コンテンツを保存（単一ファイルに追記）
-            self._save_content(url, content)
-
-            # 再帰的にリンクをクロール
-            links = self.extract_links(url)
-            for link in links:
-                self.crawl(link, max_pages)
+            await self._save_content(url, content)
+            return links
 
         except Exception as e:
             print(f"Error crawling {url}: {e}")
+            return set()
 
-    def _save_content(self, url: str, content: str) -> None:
-        """抽出したコンテンツを1つのMarkdownファイルに追記"""
-        try:
-            md = MarkItDown()
-            markdown_content = md.convert(content)
-        except Exception as e:
-            print(f"Markdown変換に失敗しました。プレーンテキストのまま保存します: {e}")
-            markdown_content = content  # 失敗時はプレーンテキスト
+    def _crawled_at(self) -> str:
+        """現在時刻を 'YYYY-mm-dd HH:MM:SS' 形式で返す（同じ秒の間はキャッシュを返す）"""
+        now = int(time.time())
+        if now != self._last_ts_epoch:
+            self._last_ts_epoch = now
+            self._last_ts_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
+        return self._last_ts_str
 
+    async def _save_content(self, url: str, content: str) -> None:
+        """抽出したコンテンツ（trafilaturaが出力したMarkdown）を1つのMarkdownファイルに追記"""
         # ファイル末尾に追記する
         page_content = f"""
 ---
 source: {url}
-crawled_at: {time.strftime('%Y-%m-%d %H:%M:%S')}
+crawled_at: {self._crawled_at()}
 ---
 
-{markdown_content}
+{content}
 
 ---
 """
 
-        # "append"モードで書き込む → 同一ファイルにどんどん追記
+        # "append"モードで開いたハンドルに書き込む → 同一ファイルにどんどん追記
+        # 書き込みは別スレッドで行われるため、ワーカー間で同時に書き込まないようロックする
+        assert self._aio_out is not None  # crawl()の中でのみ呼ばれる
         try:
-            with open(self.output_file_path, "a", encoding="utf-8") as f:
-                f.write(page_content)
+            async with self._write_lock:
+                await self._aio_out.write(page_content)
+                # 一定間隔でフラッシュする（フラッシュはワーカーが_flush_output()で行う）
+                self._pages_since_flush += 1
             print(f"[SUCCESS] {url} のコンテンツを {self.output_file_path} に追記しました。")
         except Exception as e:
             print(f"[ERROR] ファイル書き込みに失敗しました: {e}\n→ パス: {self.output_file_path}")
 
+    async def _flush_output(self) -> None:
+        """出力ファイルをフラッシュし、保留していたURLを処理済みとして記録する
+
+        出力がディスクに書き出された後でだけ.visited.txtに記録するため、途中で
+        異常終了しても、内容が失われたページが処理済みとして残ることはありません。
+        """
+        # crawl()の中でのみ呼ばれる
+        assert self._aio_out is not None and self._visited_fp is not None
+        async with self._write_lock:
+            await self._aio_out.flush()
+            self._pages_since_flush = 0
+            self._visited_fp.writelines(f"{url}\n" for url in self._unflushed_visited)
+            self._unflushed_visited.clear()
+
 def main() -> None:
     """コマンドライン引数を解析してクローラーを実行
 
@@ -222,25 +620,35 @@ def main() -> None:
     - --max-pages: クロールする最大ページ数
     - --output-dir: 出力ディレクトリ
     - --user-agent: User-Agent文字列
+    - --concurrency: 同時にクロールするワーカー数
+    - --resume: 前回のクロールを再開する
     """
     import argparse
 
     parser = argparse.ArgumentParser(description='Read the Docsドキュメントクローラー')
     parser.add_argument('url', help='クロール対象のURL（例：https://docs.pola.rs/）')
-    parser.add_argument('--max-pages', type=int, help='クロールする最大ページ数（デフォルト：制限なし）')
+    parser.add_argument('--max-pages', type=int, default=50, help='クロールする最大ページ数（デフォルト：50、0で制限なし）')
     parser.add_argument('--user-agent', default='DocCrawler/1.0', help='User-Agent文字列（デフォルト：DocCrawler/1.0）')
     parser.add_argument('--output-dir', default='output', help='出力ディレクトリ（デフォルト：output）')
+    parser.add_argument('--concurrency', type=int, default=5, help='同時にクロールするワーカー数（デフォルト：5）')
+    parser.add_argument('--resume', action='store_true', help='出力ディレクトリのチェックポイントから前回のクロールを再開する')
 
     args = parser.parse_args()
+    if args.max_pages < 0:
+        parser.error('--max-pagesには0以上を指定してください（0で制限なし）')
+    if args.concurrency < 1:
+        parser.error('--concurrencyには1以上を指定してください')
 
     # 出力ファイル名は自由に変更OK
     crawler = DocCrawler(
         base_url=args.url, 
         output_dir=args.output_dir, 
         user_agent=args.user_agent,
-        output_file_name="crawled_content.md"  # すべてのコンテンツを集約するファイル
+        output_file_name="crawled_content.md",  # すべてのコンテンツを集約するファイル
+        concurrency=args.concurrency,
+        resume=args.resume
     )
-    crawler.crawl(args.url, max_pages=args.max_pages)
+    asyncio.run(crawler.crawl(args.url, max_pages=args.max_pages or None))
 
 if __name__ == "__main__":
     main()
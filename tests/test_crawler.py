@@ -0,0 +1,332 @@
+import asyncio
+import functools
+import http.server
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, List
+
+import pytest
+
+from crawler import ROBOTS_CACHE_TTL, DocCrawler, main
+
+SRC_DIR = Path(__file__).resolve().parents[1] / "src"
+
+PAGE_COUNT = 8
+
+BODY_TEXT = "このページはクローラーのテスト用のドキュメントです。" * 20
+
+
+def _page(title: str, links: List[str]) -> str:
+    anchors = "\n".join(f'<p><a href="{href}">{href}</a></p>' for href in links)
+    return f"""<html><head><title>{title}</title></head><body><article>
+<h1>{title}</h1>
+<p>{BODY_TEXT}</p>
+<p>{BODY_TEXT}</p>
+{anchors}
+</article></body></html>"""
+
+
+class _Handler(http.server.SimpleHTTPRequestHandler):
+    # charsetはContent-Typeヘッダーでのみ伝える（ページに<meta charset>は書かない）
+    extensions_map = {".html": "text/html; charset=utf-8", ".txt": "text/plain", "": "text/plain"}
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+@pytest.fixture
+def site(tmp_path: Path) -> Path:
+    """/docs/ 以下にページが連なるドキュメントサイトを作る"""
+    root = tmp_path / "site"
+    docs = root / "docs"
+    (docs / "private").mkdir(parents=True)
+    (root / "robots.txt").write_text("User-agent: *\nDisallow: /docs/private/\n")
+
+    index_links = [f"p{i}.html#section" for i in range(1, PAGE_COUNT + 1)]
+    (docs / "index.html").write_text(_page("Index", index_links + ["private/secret.html"]))
+    for i in range(1, PAGE_COUNT + 1):
+        links = [f"p{i % PAGE_COUNT + 1}.html", "./index.html", "_static/style.css"]
+        (docs / f"p{i}.html").write_text(_page(f"Page {i}", links))
+    return root
+
+
+@pytest.fixture
+def server(site: Path) -> Iterator[str]:
+    """サイトをローカルで配信し、ホスト部分（http://127.0.0.1:PORT）を返す"""
+    httpd = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(_Handler, directory=str(site))
+    )
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _make_crawler(
+    base_url: str, output_dir: Path, concurrency: int = 5, resume: bool = False
+) -> DocCrawler:
+    """テストを速くするため、リクエスト間隔を0にしたクローラーを作る"""
+    crawler = DocCrawler(
+        base_url, output_dir=str(output_dir), concurrency=concurrency, resume=resume
+    )
+    crawler.crawl_delay = 0.0
+    return crawler
+
+
+def _sources(output_dir: Path) -> List[str]:
+    text = (output_dir / "crawled_content.md").read_text(encoding="utf-8")
+    return [line[len("source: "):] for line in text.splitlines() if line.startswith("source: ")]
+
+
+@pytest.mark.parametrize("concurrency", [0, -1])
+def test_concurrency_must_be_positive(
+    server: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch, concurrency: int
+) -> None:
+    with pytest.raises(ValueError):
+        DocCrawler(f"{server}/docs/", output_dir=str(tmp_path / "out"), concurrency=concurrency)
+
+    argv = ["crawler", f"{server}/docs/", "--concurrency", str(concurrency)]
+    monkeypatch.setattr(sys, "argv", argv)
+    with pytest.raises(SystemExit):
+        main()
+
+
+def test_negative_max_pages_is_rejected(server: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sys, "argv", ["crawler", f"{server}/docs/", "--max-pages", "-1"])
+    with pytest.raises(SystemExit):
+        main()
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("http://Example.COM/docs/page.html#section", "http://example.com/docs/page.html"),
+        ("http://example.com/docs/index.html", "http://example.com/docs/"),
+        ("http://example.com/docs/index.html#top", "http://example.com/docs/"),
+        ("http://example.com/docs/page.html?q=1#a", "http://example.com/docs/page.html?q=1"),
+        ("http://example.com", "http://example.com/"),
+        ("http://example.com/docs/PAGE.html", "http://example.com/docs/PAGE.html"),
+    ],
+)
+def test_canonicalize(server: str, tmp_path: Path, url: str, expected: str) -> None:
+    crawler = _make_crawler(f"{server}/docs/", tmp_path / "out")
+    assert crawler._canonicalize(url) == expected
+
+
+def test_is_valid_url(server: str, tmp_path: Path) -> None:
+    crawler = _make_crawler(f"{server}/docs/", tmp_path / "out")
+    host = server[len("http://"):]
+
+    assert crawler.is_valid_url(f"{server}/docs/p1.html")
+    assert crawler.is_valid_url(f"{server}/docs/p1.html#section")
+    assert crawler.is_valid_url(f"{server}/docs/")
+    # クエリは判定に使わない
+    assert crawler.is_valid_url(f"{server}/docs/search.html?q=.css")
+
+    # 似たホスト名・別スキーム・別ホスト
+    assert not crawler.is_valid_url(f"{server}.evil.example/docs/p1.html")
+    assert not crawler.is_valid_url(f"https://{host}/docs/p1.html")
+    assert not crawler.is_valid_url("http://example.com/docs/p1.html")
+    # .html でも / でもない、除外ディレクトリ、robots.txtで禁止されたパス
+    assert not crawler.is_valid_url(f"{server}/docs/_static/style.css")
+    assert not crawler.is_valid_url(f"{server}/docs/_sources/p1.html")
+    assert not crawler.is_valid_url(f"{server}/docs/_modules/mod.html")
+    assert not crawler.is_valid_url(f"{server}/docs/objects.inv?v=.html")
+    assert not crawler.is_valid_url(f"{server}/docs/private/secret.html")
+
+
+def test_robots_txt_disk_cache(site: Path, server: str, tmp_path: Path) -> None:
+    output_dir = tmp_path / "out"
+    cache_path = output_dir / ".robots_cache" / f"{server[len('http://'):].replace(':', '_')}.txt"
+    secret_url = f"{server}/docs/private/secret.html"
+
+    crawler = _make_crawler(f"{server}/docs/", output_dir)
+    assert "Disallow: /docs/private/" in cache_path.read_text(encoding="utf-8")
+    assert not crawler.is_valid_url(secret_url)
+
+    # 有効期限内はキャッシュを使う（サーバーのrobots.txtがなくなっても取得し直さない）
+    (site / "robots.txt").unlink()
+    crawler = _make_crawler(f"{server}/docs/", output_dir)
+    assert not crawler.is_valid_url(secret_url)
+
+    # 期限切れなら取得し直し、404（全許可）の結果もキャッシュする
+    expired = time.time() - ROBOTS_CACHE_TTL - 1
+    os.utime(cache_path, (expired, expired))
+    crawler = _make_crawler(f"{server}/docs/", output_dir)
+    assert crawler.is_valid_url(secret_url)
+    assert cache_path.read_text(encoding="utf-8") == ""
+    assert time.time() - cache_path.stat().st_mtime < ROBOTS_CACHE_TTL
+
+
+def test_wait_for_turn_spaces_requests_across_workers(server: str, tmp_path: Path) -> None:
+    """ワーカー数によらず、リクエストの間隔はcrawl_delayの1〜2倍になる"""
+    crawler = _make_crawler(f"{server}/docs/", tmp_path / "out", concurrency=5)
+    crawler.crawl_delay = 0.05
+
+    async def run() -> List[float]:
+        loop = asyncio.get_running_loop()
+        times: List[float] = []
+
+        async def worker() -> None:
+            for _ in range(2):
+                await crawler._wait_for_turn()
+                times.append(loop.time())
+
+        await asyncio.gather(*(worker() for _ in range(crawler.concurrency)))
+        return sorted(times)
+
+    times = asyncio.run(run())
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    assert len(gaps) == 9
+    # asyncio.sleepの誤差を考慮した許容幅
+    assert all(0.05 - 0.005 <= gap <= 0.1 + 0.03 for gap in gaps)
+
+
+def test_crawl_visits_each_page_once(server: str, tmp_path: Path) -> None:
+    output_dir = tmp_path / "out"
+    crawler = _make_crawler(f"{server}/docs/", output_dir)
+    asyncio.run(crawler.crawl(f"{server}/docs/"))
+
+    expected = {f"{server}/docs/"} | {f"{server}/docs/p{i}.html" for i in range(1, PAGE_COUNT + 1)}
+    assert crawler.visited_urls == expected
+    assert sorted(_sources(output_dir)) == sorted(expected)
+
+    # 相対リンクはページ基準のまま出力される（ホストのルート基準に解決されない）
+    content = (output_dir / "crawled_content.md").read_text(encoding="utf-8")
+    assert f"({server}/p2.html)" not in content
+
+
+@pytest.mark.parametrize("max_pages", [1, 3, 5])
+def test_max_pages_is_exact_with_several_workers(
+    server: str, tmp_path: Path, max_pages: int
+) -> None:
+    output_dir = tmp_path / "out"
+    crawler = _make_crawler(f"{server}/docs/", output_dir, concurrency=5)
+    asyncio.run(crawler.crawl(f"{server}/docs/", max_pages=max_pages))
+
+    assert len(crawler.visited_urls) == max_pages
+    assert len(_sources(output_dir)) == max_pages
+
+
+def test_crawl_with_uppercase_host(server: str, tmp_path: Path) -> None:
+    base_url = server.replace("127.0.0.1", "LOCALHOST") + "/docs/"
+    crawler = _make_crawler(base_url, tmp_path / "out")
+    lower_url = base_url.replace("LOCALHOST", "localhost")
+
+    # ホスト名の大文字・小文字の違いは同じサイトとして扱う
+    hrefs = [f"{base_url}p1.html", f"{lower_url}p2.html#top", "p3.html", "INDEX.html"]
+    # 別サイト・似たホスト名へのリンクは含めない
+    hrefs += ["https://example.com/docs/p4.html", f"{base_url[:-len('/docs/')]}.evil.example/p5.html"]
+    assert crawler._filter_links(hrefs, base_url) == {
+        f"{lower_url}p1.html",
+        f"{lower_url}p2.html",
+        f"{lower_url}p3.html",
+        f"{lower_url}INDEX.html",
+    }
+
+    asyncio.run(crawler.crawl(base_url, max_pages=3))
+
+    assert len(crawler.visited_urls) == 3
+    assert all(url.startswith(lower_url) for url in crawler.visited_urls)
+
+
+def test_non_ascii_link_uses_header_charset(site: Path, server: str, tmp_path: Path) -> None:
+    (site / "docs" / "index.html").write_text(_page("Index", ["ページ.html"]))
+    (site / "docs" / "ページ.html").write_text(_page("ページ", []))
+
+    output_dir = tmp_path / "out"
+    crawler = _make_crawler(f"{server}/docs/", output_dir)
+    asyncio.run(crawler.crawl(f"{server}/docs/"))
+
+    assert f"{server}/docs/ページ.html" in crawler.visited_urls
+    assert f"{server}/docs/ページ.html" in _sources(output_dir)
+
+
+def test_constructing_crawler_keeps_checkpoint(server: str, tmp_path: Path) -> None:
+    """チェックポイントはcrawl()を呼ぶまで開かない（生成しただけでは消えない）"""
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    (output_dir / ".visited.txt").write_text(f"{server}/docs/p1.html\n", encoding="utf-8")
+    (output_dir / ".frontier.txt").write_text(f"{server}/docs/p2.html\n", encoding="utf-8")
+
+    _make_crawler(f"{server}/docs/", output_dir)
+
+    assert (output_dir / ".visited.txt").read_text(encoding="utf-8") == f"{server}/docs/p1.html\n"
+    assert (output_dir / ".frontier.txt").read_text(encoding="utf-8") == f"{server}/docs/p2.html\n"
+
+
+@pytest.mark.parametrize(
+    "back_links, flush_every, die_at_fetch",
+    [
+        # 5ページ目まで処理し終えた（5ページ目はまだフラッシュされていない）ところで終了
+        (True, 2, 6),
+        # 子ページから開始ページへのリンクがなく、最初のフラッシュより前に終了
+        (False, 20, 3),
+    ],
+)
+def test_resume_after_partially_flushed_run(
+    site: Path, server: str, tmp_path: Path, back_links: bool, flush_every: int, die_at_fetch: int
+) -> None:
+    """出力の一部だけがフラッシュされた状態で異常終了しても、再開後に全ページがそろう"""
+    output_dir = tmp_path / "out"
+    expected = [f"{server}/docs/"] + [f"{server}/docs/p{i}.html" for i in range(1, PAGE_COUNT + 1)]
+    if not back_links:
+        child_count = 4
+        (site / "docs" / "index.html").write_text(
+            _page("Index", [f"p{i}.html" for i in range(1, child_count + 1)])
+        )
+        for i in range(1, child_count + 1):
+            (site / "docs" / f"p{i}.html").write_text(_page(f"Page {i}", []))
+        expected = expected[: child_count + 1]
+
+    # die_at_fetch回目の取得を始める時点で、後始末なしでプロセスを終了させる
+    script = textwrap.dedent(
+        """
+        import asyncio, os, sys
+        sys.path.insert(0, sys.argv[3])
+        import crawler
+
+        crawler.FLUSH_EVERY_PAGES = int(sys.argv[4])
+        die_at_fetch = int(sys.argv[5])
+        original_wait = crawler.DocCrawler._wait_for_turn
+        fetches = 0
+
+        async def wait_or_die(self):
+            global fetches
+            fetches += 1
+            if fetches == die_at_fetch:
+                os._exit(1)
+            await original_wait(self)
+
+        crawler.DocCrawler._wait_for_turn = wait_or_die
+        c = crawler.DocCrawler(sys.argv[1], output_dir=sys.argv[2], concurrency=1)
+        c.crawl_delay = 0.0
+        asyncio.run(c.crawl(sys.argv[1]))
+        """
+    )
+    result = subprocess.run(
+        [
+            sys.executable, "-c", script, f"{server}/docs/", str(output_dir), str(SRC_DIR),
+            str(flush_every), str(die_at_fetch),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        timeout=60,
+    )
+    assert result.returncode == 1
+
+    # 処理済みとして記録されたページは、すべて内容がディスクに残っていること
+    visited = (output_dir / ".visited.txt").read_text(encoding="utf-8").splitlines()
+    assert set(visited) <= set(_sources(output_dir))
+    assert len(visited) < len(expected)
+
+    crawler = _make_crawler(f"{server}/docs/", output_dir, resume=True, concurrency=1)
+    asyncio.run(crawler.crawl(f"{server}/docs/"))
+
+    assert sorted(_sources(output_dir)) == sorted(expected)